@@ -1,37 +1,24 @@
 import os
-import json
 import logging
+import logging.handlers
 import argparse
-import subprocess
+import functools
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-import meraki
-
-# Ensure required packages are installed
-required_packages = ["meraki", "requests", "python-dotenv"]
-for package in required_packages:
-    try:
-        __import__(package)
-    except ImportError:
-        subprocess.run([sys.executable, "-m", "pip", "install", package], check=True)
+import diskcache
+import orjson
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-log_filename = f"meraki_deployment_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler(log_filename), logging.StreamHandler()],
-)
+# Logging handlers are configured in main() once arguments are parsed
 logger = logging.getLogger(__name__)
 
 # Load configuration from config.json
 try:
-    with open("config.json", "r") as config_file:
-        config = json.load(config_file)
+    with open("config.json", "rb") as config_file:
+        config = orjson.loads(config_file.read())
 except FileNotFoundError:
     logger.error("Missing config.json file. Ensure it exists in the script directory.")
     sys.exit(1)
@@ -45,153 +32,290 @@ if not meraki_api_key or not organization_id:
     logger.error("Missing API key or organization ID. Ensure they are set in .env or config.json.")
     sys.exit(1)
 
-# Initialize Meraki SDK Client
-dashboard = meraki.DashboardAPI(api_key=meraki_api_key, suppress_logging=True)
+# Maximum retries for rate-limited API calls (configured in main())
+maximum_retries = 5
+
+@functools.lru_cache(maxsize=1)
+def get_dashboard():
+    """Imports the Meraki SDK and initializes the client on first use."""
+    import meraki
+    from requests.adapters import HTTPAdapter
+
+    dashboard = meraki.DashboardAPI(
+        api_key=meraki_api_key,
+        suppress_logging=True,
+        maximum_retries=maximum_retries,
+        wait_on_rate_limit=True,
+        nginx_429_retry_wait_time=1,
+        retry_4xx_error=False,
+    )
+
+    # Reuse pooled keep-alive connections across all SDK calls
+    http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+    dashboard._session._req_session.mount("https://", http_adapter)
+    dashboard._session._req_session.mount("http://", http_adapter)
+    dashboard._session._req_session.headers.update({"Connection": "keep-alive"})
+    return dashboard
+
+def api_error():
+    """Returns the Meraki SDK's APIError class, for except clauses that must not import the SDK eagerly."""
+    import meraki
+    return meraki.APIError
 
-def get_or_create_network(network_name=None, tags=None, ignore_existing=False):
-    """Fetches an existing network or creates a new one."""
+# On-disk cache for slow-changing organization lookups (configured in main())
+cache = None
+cache_ttl = 300
+
+def cached_call(key, fetch, ttl=None):
+    """Returns the cached value for key, calling fetch() and caching it on a miss."""
+    if cache is None:
+        return fetch()
+    payload = cache.get(key)
+    if payload is not None:
+        return orjson.loads(payload)
+    value = fetch()
+    cache.set(key, orjson.dumps(value), expire=ttl if ttl is not None else cache_ttl)
+    return value
+
+# Name -> ID lookups, memoized per organization for the life of the process
+name_indexes = {}
+
+def get_name_index(key, items):
+    """Returns a name -> ID dict for items, building it once per key."""
+    if key not in name_indexes:
+        # Iterate in reverse so the first item wins when names are duplicated
+        name_indexes[key] = {item["name"]: item["id"] for item in reversed(items)}
+    return name_indexes[key]
+
+def get_or_create_network(network_name=None, tags=None, ignore_existing=False, dry_run=False):
+    """Fetches an existing network or creates a new one (only reports it in dry-run mode)."""
     try:
-        # If network name is provided, try to find it
+        # The API has no name filter, so a name lookup fetches every network in as few
+        # pages as possible; otherwise a single minimal page is enough to pick the first one
         if network_name:
-            networks = dashboard.organizations.getOrganizationNetworks(organization_id)
-            for network in networks:
-                if network["name"] == network_name:
-                    if not ignore_existing:
-                        logger.warning(f"Network '{network_name}' already exists. Use --ignore-existing to use it.")
-                        return None
-                    logger.info(f"Using existing network: {network['id']} ({network_name})")
-                    return network["id"]
-            
-            # Network not found, create it
-            network = dashboard.organizations.createOrganizationNetwork(
-                organization_id,
-                name=network_name,
-                productTypes=["appliance", "switch"],
-                timezone=default_timezone,
-                tags=tags if tags else []
-            )
-            logger.info(f"Created network: {network['id']} ({network_name})")
-            return network["id"]
+            cache_key, page_kwargs = f"networks:{organization_id}", {"perPage": 100000, "total_pages": "all"}
         else:
-            # No name provided, use first available network
-            networks = dashboard.organizations.getOrganizationNetworks(organization_id)
-            if networks:
-                network_id = networks[0]["id"]
-                logger.info(f"Using existing network: {network_id} ({networks[0]['name']})")
+            cache_key, page_kwargs = f"networks:{organization_id}:first", {"perPage": 3, "total_pages": 1}
+        networks = cached_call(
+            cache_key,
+            lambda: get_dashboard().organizations.getOrganizationNetworks(organization_id, **page_kwargs),
+        )
+
+        # If network name is provided, try to find it
+        if network_name:
+            network_id = get_name_index(f"networks:{organization_id}", networks).get(network_name)
+            if network_id:
+                if not ignore_existing:
+                    logger.warning(f"Network '{network_name}' already exists. Use --ignore-existing to use it.")
+                    return None
+                logger.info(f"Using existing network: {network_id} ({network_name})")
                 return network_id
-            else:
-                # No networks found, create a default one
-                network = dashboard.organizations.createOrganizationNetwork(
-                    organization_id,
-                    name="Automated Network",
-                    productTypes=["appliance", "switch"],
-                    timezone=default_timezone,
-                    tags=tags if tags else []
-                )
-                logger.info(f"Created network: {network['id']} (Automated Network)")
-                return network["id"]
-    except meraki.APIError as e:
+        elif networks:
+            # No name provided, use first available network
+            network_id = networks[0]["id"]
+            logger.info(f"Using existing network: {network_id} ({networks[0]['name']})")
+            return network_id
+
+        # Network not found, create it (or a default one when no name was given)
+        name = network_name or "Automated Network"
+        if dry_run:
+            logger.info(f"Would create network '{name}'")
+            return f"<new network '{name}'>"
+        network = get_dashboard().organizations.createOrganizationNetwork(
+            organization_id,
+            name=name,
+            productTypes=["appliance", "switch"],
+            timezone=default_timezone,
+            tags=tags if tags else []
+        )
+        logger.info(f"Created network: {network['id']} ({name})")
+        name_indexes.pop(f"networks:{organization_id}", None)
+        if cache is not None:
+            cache.delete(f"networks:{organization_id}")
+            cache.delete(f"networks:{organization_id}:first")
+        return network["id"]
+    except api_error() as e:
         logger.error(f"Error with network operations: {e}")
         sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
+def get_organization_devices(org_id):
+    """Fetches the organization's device inventory, cached on disk for 60 seconds."""
+    return cached_call(
+        f"devices:{org_id}",
+        lambda: get_dashboard().organizations.getOrganizationDevices(org_id),
+        ttl=60,
+    )
+
 def get_available_devices():
-    """Fetches available switches and MX85 appliances from the organization."""
+    """Fetches available switch and MX85 appliance (serial, model) pairs from the organization."""
     try:
-        devices = dashboard.organizations.getOrganizationDevices(organization_id)
-        switch_serial, mx85_serial = None, None
+        devices = get_organization_devices(organization_id)
+        switch, mx85 = None, None
         for device in devices:
-            if "MS" in device["model"] and not switch_serial:
-                switch_serial = device["serial"]
-            elif "MX85" in device["model"] and not mx85_serial:
-                mx85_serial = device["serial"]
-        if switch_serial and mx85_serial:
-            logger.info(f"Found devices: Switch={switch_serial}, MX85={mx85_serial}")
-            return switch_serial, mx85_serial
-    except meraki.APIError as e:
+            if not switch and device["model"].startswith("MS"):
+                switch = (device["serial"], device["model"])
+            elif not mx85 and device["model"].startswith("MX85"):
+                mx85 = (device["serial"], device["model"])
+            if switch and mx85:
+                break
+        if switch and mx85:
+            logger.info(f"Found devices: Switch={switch[0]}, MX85={mx85[0]}")
+            return switch, mx85
+    except api_error() as e:
         logger.error(f"Error retrieving devices: {e}")
     sys.exit(1)
 
-def deploy_meraki_device(serial_number, network_id, device_type, address=None):
-    """Deploys a Meraki device to a network and verifies successful deployment."""
+def deploy_meraki_devices(devices, network_id, address=None):
+    """Claims (serial, model, device_type) devices into a network in one action batch, then names them."""
+    dashboard = get_dashboard()
     try:
-        # Claim the device into the network
-        dashboard.networks.claimNetworkDevices(network_id, serials=[serial_number])
-        logger.info(f"{device_type} {serial_number} deployment initiated.")
-
-        # Set device name based on model
-        try:
-            device_info = dashboard.devices.getDevice(serial_number)
-            device_name = f"{device_info['model']}_{serial_number}"
-            dashboard.devices.updateDevice(serial_number, name=device_name)
-            logger.info(f"Device named as: {device_name}")
-            
-            # Set device address if provided
-            if address:
-                dashboard.devices.updateDevice(serial_number, address=address, moveMapMarker=True)
-                logger.info(f"Device address set to: {address}")
-        except meraki.APIError as e:
-            logger.warning(f"Could not set device name or address: {e}")
+        # Claim every device in one atomic batch; a failure means nothing was claimed
+        batch = dashboard.organizations.createOrganizationActionBatch(
+            organization_id,
+            actions=[
+                {
+                    "resource": f"/networks/{network_id}/devices",
+                    "operation": "claim",
+                    "body": {"serials": [serial_number]},
+                }
+                for serial_number, _, _ in devices
+            ],
+            confirmed=True,
+            synchronous=True,
+        )
 
-        # Verify if the device is assigned to the network
-        devices = dashboard.networks.getNetworkDevices(network_id)
-        assigned_serials = [device["serial"] for device in devices]
-
-        if serial_number in assigned_serials:
-            logger.info(f"Verification Successful: {device_type} {serial_number} is now in the network.")
+        status = batch.get("status", {})
+        if status.get("completed") and not status.get("failed"):
+            for serial_number, _, device_type in devices:
+                logger.info(f"Verification Successful: {device_type} {serial_number} claimed via action batch.")
         else:
-            logger.error(f"Verification Failed: {device_type} {serial_number} is NOT found in the network.")
+            logger.error(f"Verification Failed: claim action batch did not complete: {status.get('errors')}")
             sys.exit(1)
 
-    except meraki.APIError as e:
-        logger.error(f"Failed to deploy {device_type}: {e}")
+    except api_error() as e:
+        logger.error(f"Failed to deploy devices: {e}")
         sys.exit(1)
 
+    # Set device names and address in a second batch; failures here leave the devices claimed
+    try:
+        # Look up models (for naming) only for devices that came without one
+        models = {serial_number: model for serial_number, model, _ in devices if model}
+        missing_serials = [serial_number for serial_number, _, _ in devices if serial_number not in models]
+        if missing_serials:
+            try:
+                models.update(
+                    (device["serial"], device["model"])
+                    for device in dashboard.organizations.getOrganizationDevices(
+                        organization_id, serials=missing_serials
+                    )
+                )
+            except api_error() as e:
+                logger.warning(f"Could not look up device models for naming: {e}")
+
+        actions = []
+        device_names = []
+        for serial_number, _, device_type in devices:
+            update_body = {}
+            if serial_number in models:
+                update_body["name"] = f"{models[serial_number]}_{serial_number}"
+                device_names.append(update_body["name"])
+            else:
+                logger.warning(f"Could not name {device_type} {serial_number}: model unknown")
+            if address:
+                update_body.update(address=address, moveMapMarker=True)
+            if update_body:
+                actions.append({
+                    "resource": f"/devices/{serial_number}",
+                    "operation": "update",
+                    "body": update_body,
+                })
+
+        if actions:
+            batch = dashboard.organizations.createOrganizationActionBatch(
+                organization_id, actions=actions, confirmed=True, synchronous=True
+            )
+            status = batch.get("status", {})
+            if status.get("completed") and not status.get("failed"):
+                for device_name in device_names:
+                    logger.info(f"Device named as: {device_name}")
+                if address:
+                    logger.info(f"Device address set to: {address}")
+            else:
+                logger.warning(f"Could not set device name or address: {status.get('errors')}")
+    except api_error() as e:
+        logger.warning(f"Could not set device name or address: {e}")
+
 def bind_network_to_template(network_id, template_name):
     """Binds a network to a configuration template."""
     try:
         # Get available templates
-        templates = dashboard.organizations.getOrganizationConfigTemplates(organization_id)
+        templates = cached_call(
+            f"templates:{organization_id}",
+            lambda: get_dashboard().organizations.getOrganizationConfigTemplates(organization_id),
+        )
         
         # Find the requested template
-        template_id = None
-        for template in templates:
-            if template["name"] == template_name:
-                template_id = template["id"]
-                break
-                
+        template_id = get_name_index(f"templates:{organization_id}", templates).get(template_name)
+
         if not template_id:
             logger.error(f"Template '{template_name}' not found")
             return False
             
         # Bind network to template
-        dashboard.networks.bindNetwork(network_id, configTemplateId=template_id)
+        get_dashboard().networks.bindNetwork(network_id, configTemplateId=template_id)
         logger.info(f"Network successfully bound to template '{template_name}'")
         return True
         
-    except meraki.APIError as e:
+    except api_error() as e:
         logger.error(f"Failed to bind network to template: {e}")
         return False
 
+# Command-line interface, built once at import
+parser = argparse.ArgumentParser(description="Automate Meraki device deployment.")
+parser.add_argument("--dry-run", action="store_true", help="Run in dry-run mode without making changes")
+parser.add_argument("--network-name", help="Name of network to create or use")
+parser.add_argument("--network-id", help="ID of an existing network to use (skips network lookup)")
+parser.add_argument("--tags", type=lambda s: [t for t in s.split(",") if t], help="Comma-separated tags to apply to the network")
+parser.add_argument("--template", help="Name of configuration template to bind the network to")
+parser.add_argument("--address", help="Street address for deployed devices (for map placement)")
+parser.add_argument("--ignore-existing", action="store_true", help="Use existing network if it exists")
+parser.add_argument("--switch-serial", help="Serial number of switch to deploy (overrides auto-detection)")
+parser.add_argument("--appliance-serial", help="Serial number of appliance to deploy (overrides auto-detection)")
+parser.add_argument("--no-cache", action="store_true", help="Always fetch networks, templates and devices from the API")
+parser.add_argument("--cache-ttl", type=int, default=300, help="Seconds to cache network and template lookups (default: 300)")
+parser.add_argument("--max-retries", type=int, default=5, help="Maximum retries for rate-limited API calls (default: 5)")
+
 def main():
     """Main execution flow for Meraki device deployment."""
-    parser = argparse.ArgumentParser(description="Automate Meraki device deployment.")
-    parser.add_argument("--dry-run", action="store_true", help="Run in dry-run mode without making changes")
-    parser.add_argument("--network-name", help="Name of network to create or use")
-    parser.add_argument("--tags", help="Comma-separated tags to apply to the network")
-    parser.add_argument("--template", help="Name of configuration template to bind the network to")
-    parser.add_argument("--address", help="Street address for deployed devices (for map placement)")
-    parser.add_argument("--ignore-existing", action="store_true", help="Use existing network if it exists")
-    parser.add_argument("--switch-serial", help="Serial number of switch to deploy (overrides auto-detection)")
-    parser.add_argument("--appliance-serial", help="Serial number of appliance to deploy (overrides auto-detection)")
     args = parser.parse_args()
 
+    # Configure logging (the log file is only opened on first write)
+    log_filename = f"meraki_deployment_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.log"
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.handlers.RotatingFileHandler(log_filename, maxBytes=10_000_000, backupCount=3, delay=True),
+            logging.StreamHandler(),
+        ],
+    )
+
+    global maximum_retries, cache, cache_ttl
+    maximum_retries = args.max_retries
+
+    if not args.no_cache:
+        cache = diskcache.Cache("./.meraki_cache")
+        cache_ttl = args.cache_ttl
+
     logger.info("Starting Meraki Deployment...")
     
-    # Convert tags string to list if provided
-    tags = args.tags.split(',') if args.tags else None
-    
-    # Create or get network
-    network_id = get_or_create_network(args.network_name, tags, args.ignore_existing)
+    # Use the provided network ID, or create or get network
+    if args.network_id:
+        network_id = args.network_id
+        logger.info(f"Using provided network ID: {network_id}")
+    else:
+        network_id = get_or_create_network(args.network_name, args.tags, args.ignore_existing, args.dry_run)
     if not network_id:
         sys.exit(1)
     
@@ -202,15 +326,18 @@ def main():
     
     # Get device serials (either from args or auto-detect)
     if args.switch_serial and args.appliance_serial:
-        switch_serial = args.switch_serial
-        mx85_serial = args.appliance_serial
+        switch_serial, switch_model = args.switch_serial, None
+        mx85_serial, mx85_model = args.appliance_serial, None
         logger.info(f"Using provided device serials: Switch={switch_serial}, MX85={mx85_serial}")
     else:
-        switch_serial, mx85_serial = get_available_devices()
+        (switch_serial, switch_model), (mx85_serial, mx85_model) = get_available_devices()
 
     if not args.dry_run:
-        deploy_meraki_device(switch_serial, network_id, "Switch", args.address)
-        deploy_meraki_device(mx85_serial, network_id, "MX85 Security Appliance", args.address)
+        deploy_meraki_devices(
+            [(switch_serial, switch_model, "Switch"), (mx85_serial, mx85_model, "MX85 Security Appliance")],
+            network_id,
+            args.address,
+        )
         logger.info("Deployment completed successfully!")
     else:
         logger.info("Dry-run mode enabled. No actual changes were made.")